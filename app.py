@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import mysql.connector
+from typing import Union
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.middleware.cors import CORSMiddleware
+from kafka import KafkaConsumer
+from Schmeas.Schemas import DataResourceConfig, PredictionRequest, PredictionResponse
+from consts.paths_and_numbers import (FLAG_TRUE_VALUES, PREDICTION_CACHE_TTL, PROFILE_RING_SIZE, REFERENCE_PROFILE_NAME,
+                                      SHARED_STATE_ENV_VAR)
+from src.etp_orchestrator import ETPPipeline
+from src.data_extractor import DataExtractor
+from src.data_transformer import DataTransformer
+from src.data_monitor import DataMonitor
+from src.data_predictor import PurchasePredictor
+from src.kafka_replay import KafkaRecorder, ReplayConsumer
+from src.pipeline_profiler import PipelineProfiler
+from src.prediction_cache import PredictionCache
+from src.shared_state import SharedState
+
+# Initialize the FastAPI app
+app = FastAPI()
+origins = ["*"]
+methods = ["*"]
+headers = ["*"]
+
+# Enable later integration to API Gateway
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=methods,
+    allow_headers=headers
+)
+
+# We will follow the requests from when the service is initialized and inform the user
+REQUEST_ID_COUNTER = 0
+
+# in multi-worker mode the parent process publishes the name of the shared state segments in the environment
+shared_state = SharedState(os.environ[SHARED_STATE_ENV_VAR]) if os.environ.get(SHARED_STATE_ENV_VAR) else None
+
+# version of the broadcast data resource configuration this worker is initialized with
+DATA_RESOURCES_VERSION = 0
+
+# create the data processor object
+data_transformer = DataTransformer()
+
+# the prediction cache is optional, it is enabled by setting its size
+prediction_cache_size = int(os.environ.get('PREDICTION_CACHE_SIZE', 0))
+prediction_cache = PredictionCache(
+    prediction_cache_size, float(os.environ.get('PREDICTION_CACHE_TTL', PREDICTION_CACHE_TTL))
+) if prediction_cache_size > 0 else None
+
+# initiate a Model object once the service is initialized to not repeat loading the model
+data_predictor = PurchasePredictor(shared_state=shared_state, prediction_cache=prediction_cache)
+
+# create the data monitor, compared with the training data profile when one is shipped with the model
+reference_profile_path = os.path.join(os.path.dirname(__file__), 'src', REFERENCE_PROFILE_NAME)
+data_monitor = DataMonitor(
+    reference_profile_path if os.path.exists(reference_profile_path) else None,
+    publish_dir=os.path.join(shared_state.work_dir, 'data_statistics') if shared_state else None)
+
+# create the profiler, runs are sampled at PROFILE_SAMPLE_RATE and, only when PROFILE_HEADER_ENABLED is set,
+# profiled on the X-Profile header since profiling traces the whole worker. With several workers the
+# profiles are kept in the shared directory so any worker can serve them
+PROFILE_HEADER_ENABLED = os.environ.get('PROFILE_HEADER_ENABLED', '').lower() in FLAG_TRUE_VALUES
+# the stored profiles expose internal code paths, so the /admin/profiles routes only serve them when
+# PROFILE_ADMIN_ENABLED is set
+PROFILE_ADMIN_ENABLED = os.environ.get('PROFILE_ADMIN_ENABLED', '').lower() in FLAG_TRUE_VALUES
+pipeline_profiler = PipelineProfiler(
+    int(os.environ.get('PROFILE_RING_SIZE', PROFILE_RING_SIZE)), float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    directory=os.path.join(shared_state.work_dir, 'profiles') if shared_state else None)
+
+# create the extract transform and predict pipeline orchstrator object
+etp_pipeline = ETPPipeline(data_transformer, data_predictor, data_monitor, pipeline_profiler)
+
+def create_data_extractor(kafka_config, mysql_config):
+    '''This function creates a data extractor from the Kafka and MySQL configurations'''
+    # Replay a recorded stream instead of consuming from Kafka, for offline profiling and load tests.
+    # Every worker would replay the whole recording and serve whichever requests it is routed, so the
+    # replay is only faithful and deterministic with a single worker and is rejected with several
+    if kafka_config.get('replay_dir'):
+        if shared_state:
+            raise HTTPException(status_code=400, detail={
+                                "message": "Replay requires a single worker, run the service with WORKERS=1."})
+        try:
+            consumer = ReplayConsumer(
+                kafka_config['replay_dir'],
+                speed=kafka_config.get('replay_speed', 1.0),
+                loop=kafka_config.get('replay_loop', False)
+            )
+        except Exception as error_message:
+            logging.error(msg=error_message, exc_info=True)
+            raise HTTPException(status_code=400, detail={
+                                "message": "Error initializing replay: {}".format(str(error_message))})
+        return DataExtractor(consumer, connect_mysql(mysql_config))
+
+    # Create Kafka consumer instance, the messages are kept as raw bytes and parsed by the data extractor
+    try:
+        consumer = KafkaConsumer(
+            kafka_config['topics'],
+            bootstrap_servers=kafka_config['bootstrap_servers'],
+            group_id=kafka_config['group_id'],
+            auto_offset_reset=kafka_config['auto_offset_reset'],
+            enable_auto_commit=kafka_config['enable_auto_commit']
+        )
+        # record the consumed messages so the stream can be replayed later
+        if kafka_config.get('record_dir'):
+            consumer = KafkaRecorder(consumer, kafka_config['record_dir'])
+    except Exception as error_message:
+        logging.error(msg=error_message, exc_info=True)
+        raise HTTPException(status_code=400, detail={
+                            "message": "Error initializing Kafka: {}".format(str(error_message))})
+
+    return DataExtractor(consumer, connect_mysql(mysql_config))
+
+def connect_mysql(mysql_config):
+    '''This function creates a MySQL connection from the MySQL configuration'''
+    # Create MySQL connection instance
+    try:
+        connection = mysql.connector.connect(
+            host=mysql_config['host'],
+            user=mysql_config['user'],
+            password=mysql_config['password'],
+            database=mysql_config['database'])
+    except Exception as error_message:
+        logging.error(msg=error_message, exc_info=True)
+        raise HTTPException(status_code=400, detail={
+                            "message": "Error initializing Kafka: {}".format(str(error_message))})
+
+    return connection
+
+def sync_data_resources():
+    '''This function re-initializes the data resources of this worker if another worker received a newer configuration'''
+    global DATA_RESOURCES_VERSION
+    # the version is checked without the lock, the lock is only taken when there is a newer configuration
+    if not shared_state or shared_state.config_version() <= DATA_RESOURCES_VERSION:
+        return
+    version, config = shared_state.read_config()
+    if version > DATA_RESOURCES_VERSION:
+        etp_pipeline.set_data_extractor(create_data_extractor(config['kafka_config'], config['mysql_config']))
+        DATA_RESOURCES_VERSION = version
+
+def next_request_id():
+    '''This function returns the id of the current request, shared across workers in multi-worker mode'''
+    global REQUEST_ID_COUNTER
+    if shared_state:
+        return shared_state.next_request_id()
+    request_id = REQUEST_ID_COUNTER
+    REQUEST_ID_COUNTER += 1
+    return request_id
+
+# base route
+@app.get("/")
+async def root():
+    return {"message": "Welcome to the MoonActive API!"}
+# route for the initialization of the data resources
+@app.post("/init_data_resources")
+async def init_data_resources(body: DataResourceConfig):
+    # Create a kafka consumer and an mysql connection, the stream controling service will send the
+    # configs for this specific prediction microservice. that way we can allow scalability.
+    try:
+        # Load Kafka consumer configuration from JSON formatted string
+        kafka_config = json.loads(body.kafka_config)
+        # Load MySQL connector configuration from JSON formatted string
+        mysql_config = json.loads(body.mysql_config)
+    except Exception as error_message:
+        logging.error(msg=error_message, exc_info=True)
+        raise HTTPException(status_code=400, detail={
+                            "message": "Error formating resources configuration: {}".format(str(error_message))})
+    # Create the Kafka and MySQL instances for this worker
+    data_extractor = create_data_extractor(kafka_config, mysql_config)
+
+    # Set data extractor instance
+    etp_pipeline.set_data_extractor(data_extractor)
+
+    # broadcast the configuration so the other workers initialize their own resources
+    if shared_state:
+        global DATA_RESOURCES_VERSION
+        DATA_RESOURCES_VERSION = shared_state.publish_config(
+            {'kafka_config': kafka_config, 'mysql_config': mysql_config})
+
+    return {"message": "Kafka and MySQL initialized successfully."}
+
+# route for the batch predictions webhook
+@app.post("/predictions_webhook", response_model=PredictionResponse)
+async def return_batch_predictions(body: PredictionRequest, x_profile: Union[str, None] = Header(default=None)):
+    sync_data_resources()
+    if not etp_pipeline.data_extractor:
+        raise HTTPException(status_code=400, detail={
+                            "message": "Data resources not initialized. Please call /init_data_resources first."})
+    try:
+        # the request id is taken before the run so a profile of the run can be tagged with it
+        request_id = next_request_id()
+        # run the ETL pipeline with the batch size from the request
+        logging.info("Running ETL pipeline with batch size: {}".format(body.batch_size))
+        profile = PROFILE_HEADER_ENABLED and (x_profile or '').lower() in FLAG_TRUE_VALUES
+        result_dict, corrupt_data_user_ids = await etp_pipeline.run(
+            body.batch_size, request_id=request_id, profile=profile)
+
+        # create the response object
+        response = PredictionResponse(
+            request_id=request_id,
+            predictions=json.dumps(result_dict),
+            corrupt_data_user_ids=corrupt_data_user_ids
+        )
+        return response
+    except Exception as error_message:
+        logging.error(msg=error_message, exc_info=True)
+        raise error_message
+
+# close the Kafka consumer and flush the recorded Kafka segments when the service stops
+@app.on_event("shutdown")
+async def close_data_resources():
+    etp_pipeline.close_data_extractor()
+
+# route for the data quality and drift statistics, merged over all the workers
+@app.get("/data_statistics")
+async def data_statistics():
+    return data_monitor.combined_summary()
+
+# route for the hit rate metrics of the prediction cache of this worker
+@app.get("/prediction_cache")
+async def prediction_cache_stats():
+    if not prediction_cache:
+        raise HTTPException(status_code=404, detail={
+                            "message": "Prediction cache is disabled. Set PREDICTION_CACHE_SIZE to enable it."})
+    return prediction_cache.stats()
+
+# route for the list of the last profiled pipeline runs of all the workers
+@app.get("/admin/profiles")
+async def list_profiles():
+    check_profile_admin_enabled()
+    return pipeline_profiler.list_profiles()
+
+# route for the CPU and allocation summaries of a profiled run
+@app.get("/admin/profiles/{request_id}")
+async def get_profile(request_id: int):
+    profile = get_stored_profile(request_id)
+    return {key: value for key, value in profile.items() if key != 'cpu_profile'}
+
+# route for downloading the CPU profile of a run in the pstats format
+@app.get("/admin/profiles/{request_id}/download")
+async def download_profile(request_id: int):
+    profile = get_stored_profile(request_id)
+    return Response(content=profile['cpu_profile'], media_type="application/octet-stream", headers={
+        "Content-Disposition": "attachment; filename=etp_run_{}.prof".format(request_id)})
+
+def check_profile_admin_enabled():
+    '''This function raises a 404 unless the operator enabled the profile routes'''
+    if not PROFILE_ADMIN_ENABLED:
+        raise HTTPException(status_code=404, detail={
+                            "message": "Profile routes are disabled. Set PROFILE_ADMIN_ENABLED to enable them."})
+
+def get_stored_profile(request_id):
+    '''This function returns the stored profile of a request or raises a 404'''
+    check_profile_admin_enabled()
+    profile = pipeline_profiler.get_profile(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail={
+                            "message": "No stored profile for request {}.".format(request_id)})
+    return profile
@@ -1,3 +1,25 @@
 
 MODEL_NAME = "purchase_prediction_model.h5"
-REAL_TIME_COLS = ['user_id','last_page_1', 'last_page_2', 'last_page_3', 'time_spent_1', 'time_spent_2', 'time_spent_3']
\ No newline at end of file
+REAL_TIME_COLS = ['user_id','last_page_1', 'last_page_2', 'last_page_3', 'time_spent_1', 'time_spent_2', 'time_spent_3']
+SHARED_STATE_ENV_VAR = "MOON_SHARED_STATE"
+SHARED_STATE_NAME = "moon_predictor"
+SHARED_META_MAX_BYTES = 4096
+SHARED_CONFIG_MAX_BYTES = 16384
+REFERENCE_PROFILE_NAME = "reference_profile.json"
+# columns whose negative or missing values are imputed by the data transformer
+IMPUTED_COLS = ['time_spent_1', 'time_spent_2', 'time_spent_3', 'total_purchases', 'total_amount_spent',
+                'average_order_value', 'days_since_last_purchase']
+MONITOR_RELATIVE_ACCURACY = 0.01
+MONITOR_MIN_VALUE = 1e-6
+MONITOR_MAX_VALUE = 1e9
+MONITOR_QUANTILES = [0.5, 0.9, 0.99]
+PSI_BINS = 10
+REPLAY_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+RECORD_FLUSH_EVERY = 1000
+PREDICTION_CACHE_SIZE = 100000
+PREDICTION_CACHE_TTL = 60
+PROFILE_RING_SIZE = 20
+PROFILE_TOP_ENTRIES = 30
+MONITOR_PUBLISH_SECONDS = 5
+PREDICTION_CACHE_EVICT_FRACTION = 0.01
+FLAG_TRUE_VALUES = ('1', 'true', 'yes')
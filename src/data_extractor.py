@@ -40,7 +40,7 @@ class DataExtractor:
             logging.info("extracting data from kafka stream")
             # iterate over the messages in the kafka stream and compile a batch of real-time data
             kafka_data = pd.DataFrame()
-            for msg in self.kafka_consumer:
+            async for msg in _consume(self.kafka_consumer):
                 row = pd.json_normalize(json.loads(msg.value))
                 if not all(col_name in row.columns for col_name in REAL_TIME_COLS):
                     raise ValueError(
@@ -76,3 +76,14 @@ class DataExtractor:
             # log error
             logging.error(error_message)
             raise error_message
+
+
+async def _consume(kafka_consumer):
+    '''This function yields the messages of a consumer, a consumer that waits for its messages
+    asynchronously, like the replay of a recorded stream, is awaited so it does not block the event loop'''
+    if hasattr(kafka_consumer, '__anext__'):
+        async for msg in kafka_consumer:
+            yield msg
+    else:
+        for msg in kafka_consumer:
+            yield msg
@@ -0,0 +1,346 @@
+# a class for streaming data quality and drift statistics over the model inputs and outputs
+import glob
+import json
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from consts.paths_and_numbers import (IMPUTED_COLS, MONITOR_MAX_VALUE, MONITOR_MIN_VALUE, MONITOR_PUBLISH_SECONDS,
+                                      MONITOR_QUANTILES, MONITOR_RELATIVE_ACCURACY, PSI_BINS)
+
+
+class DataProfile:
+    '''This class keeps count, mean, variance, min, max and a mergeable quantile sketch per column.
+    The sketch uses fixed logarithmic buckets (DDSketch style), so memory does not grow with the
+    stream and two profiles with the same accuracy can be merged or compared bucket by bucket'''
+
+    def __init__(self, columns=None, relative_accuracy=MONITOR_RELATIVE_ACCURACY,
+                 min_value=MONITOR_MIN_VALUE, max_value=MONITOR_MAX_VALUE):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.log_gamma = np.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.min_index = int(np.floor(np.log(min_value) / self.log_gamma))
+        self.n_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.min_index + 1
+        # buckets are ordered: negative values (largest magnitude first), zero, positive values
+        magnitudes = 2 * np.exp((np.arange(self.n_buckets) + self.min_index) * self.log_gamma) / (
+            1 + np.exp(self.log_gamma))
+        self.bucket_values = np.concatenate([-magnitudes[::-1], [0.0], magnitudes])
+        self.columns = None
+        if columns is not None:
+            self._init_columns(list(columns))
+
+    def _init_columns(self, columns):
+        k = len(columns)
+        self.columns = columns
+        self.count = np.zeros(k, dtype=np.int64)
+        self.missing = np.zeros(k, dtype=np.int64)
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.sketch = np.zeros((k, len(self.bucket_values)), dtype=np.int64)
+
+    def update(self, df: pd.DataFrame):
+        '''This function folds a batch into the statistics in a single vectorized pass'''
+        if self.columns is None:
+            self._init_columns(list(df.columns))
+        values = df[self.columns].to_numpy(dtype=np.float64)
+        if values.size == 0:
+            return
+        valid = ~np.isnan(values)
+        batch_count = valid.sum(axis=0)
+        filled = np.where(valid, values, 0.0)
+        batch_mean = filled.sum(axis=0) / np.maximum(batch_count, 1)
+        batch_m2 = (np.where(valid, values - batch_mean, 0.0) ** 2).sum(axis=0)
+        # merge the batch moments into the running moments (Chan et al.)
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * batch_count / np.maximum(total, 1)
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * batch_count / np.maximum(total, 1)
+        self.count = total
+        self.missing += len(values) - batch_count
+        self.min = np.fmin(self.min, np.where(valid, values, np.inf).min(axis=0))
+        self.max = np.fmax(self.max, np.where(valid, values, -np.inf).max(axis=0))
+        # bucket every valid value and count all columns at once with a single bincount
+        buckets = self._bucket_index(filled)
+        flat = (buckets + np.arange(len(self.columns)) * len(self.bucket_values))[valid]
+        self.sketch += np.bincount(flat, minlength=self.sketch.size).reshape(self.sketch.shape)
+
+    def _bucket_index(self, values):
+        magnitude = np.abs(values)
+        with np.errstate(divide='ignore'):
+            index = np.ceil(np.log(np.maximum(magnitude, self.min_value)) / self.log_gamma) - self.min_index
+        index = np.clip(index, 0, self.n_buckets - 1).astype(np.int64)
+        return np.where(magnitude < self.min_value, self.n_buckets,
+                        np.where(values > 0, self.n_buckets + 1 + index, self.n_buckets - 1 - index))
+
+    def merge(self, other):
+        '''This function merges another profile with the same columns and bucket layout into this one'''
+        self._check_compatible(other)
+        if other.columns is None:
+            return
+        if self.columns is None:
+            self._init_columns(other.columns)
+        if self.columns != other.columns:
+            raise ValueError("Profiles with different columns can not be merged")
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / np.maximum(total, 1)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / np.maximum(total, 1)
+        self.count = total
+        self.missing = self.missing + other.missing
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        self.sketch = self.sketch + other.sketch
+
+    def quantiles(self, quantiles=MONITOR_QUANTILES):
+        '''This function returns the approximate quantiles per column as a (columns, quantiles) array'''
+        cumulative = np.cumsum(self.sketch, axis=1)
+        ranks = np.outer(cumulative[:, -1], quantiles)
+        index = (cumulative[:, None, :] < ranks[:, :, None]).sum(axis=2)
+        result = self.bucket_values[np.minimum(index, len(self.bucket_values) - 1)]
+        # report the exact extremes instead of the bucket values and nothing for empty columns
+        result = np.clip(result, self.min[:, None], self.max[:, None])
+        return np.where(cumulative[:, -1:] > 0, result, np.nan)
+
+    def variance(self):
+        '''This function returns the sample variance per column'''
+        return np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), np.nan)
+
+    def summary(self) -> dict:
+        '''This function returns the statistics per column'''
+        if self.columns is None:
+            return {}
+        quantiles = self.quantiles()
+        variance = self.variance()
+        return {
+            column: {
+                'count': int(self.count[i]),
+                'missing': int(self.missing[i]),
+                'mean': _to_json_float(self.mean[i] if self.count[i] else np.nan),
+                'variance': _to_json_float(variance[i]),
+                'min': _to_json_float(self.min[i] if self.count[i] else np.nan),
+                'max': _to_json_float(self.max[i] if self.count[i] else np.nan),
+                'quantiles': {str(q): _to_json_float(v) for q, v in zip(MONITOR_QUANTILES, quantiles[i])},
+            } for i, column in enumerate(self.columns)
+        }
+
+    def compare(self, reference) -> dict:
+        '''This function compares this profile with a reference profile, per shared column it returns
+        the shift of the mean in reference standard deviations and the population stability index'''
+        self._check_compatible(reference)
+        if self.columns is None or reference.columns is None:
+            return {}
+        drift = {}
+        reference_std = np.sqrt(reference.variance())
+        for column in self.columns:
+            if column not in reference.columns:
+                continue
+            i, j = self.columns.index(column), reference.columns.index(column)
+            if not self.count[i] or not reference.count[j]:
+                continue
+            mean_shift = (self.mean[i] - reference.mean[j]) / reference_std[j] if reference_std[j] > 0 else np.nan
+            drift[column] = {
+                'mean_shift': _to_json_float(mean_shift),
+                'psi': _to_json_float(_population_stability_index(self.sketch[i], reference.sketch[j])),
+            }
+        return drift
+
+    def _check_compatible(self, other):
+        if (other.relative_accuracy, other.min_value, other.max_value) != (
+                self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("Profiles with different sketch parameters can not be combined")
+
+    def to_dict(self) -> dict:
+        '''This function serializes the profile, only the non empty sketch buckets are stored'''
+        profile = {
+            'relative_accuracy': self.relative_accuracy,
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'columns': self.columns,
+        }
+        if self.columns is not None:
+            profile.update({
+                'count': self.count.tolist(),
+                'missing': self.missing.tolist(),
+                'mean': self.mean.tolist(),
+                'm2': self.m2.tolist(),
+                'min': [_to_json_float(x) for x in self.min],
+                'max': [_to_json_float(x) for x in self.max],
+                'sketch': [{str(b): int(row[b]) for b in np.flatnonzero(row)} for row in self.sketch],
+            })
+        return profile
+
+    @classmethod
+    def from_dict(cls, profile: dict):
+        '''This function rebuilds a profile from its serialized form'''
+        result = cls(profile['columns'], profile['relative_accuracy'], profile['min_value'], profile['max_value'])
+        if profile['columns'] is not None:
+            result.count = np.array(profile['count'], dtype=np.int64)
+            result.missing = np.array(profile['missing'], dtype=np.int64)
+            result.mean = np.array(profile['mean'], dtype=np.float64)
+            result.m2 = np.array(profile['m2'], dtype=np.float64)
+            result.min = np.array([np.inf if x is None else x for x in profile['min']], dtype=np.float64)
+            result.max = np.array([-np.inf if x is None else x for x in profile['max']], dtype=np.float64)
+            for row, buckets in zip(result.sketch, profile['sketch']):
+                for bucket, count in buckets.items():
+                    row[int(bucket)] = count
+        return result
+
+
+class DataMonitor:
+    '''This class collects data quality counters and streaming profiles of the model inputs and
+    predictions, and compares them with a reference profile computed on the training data.
+    With several workers every monitor publishes its state to a shared directory at most every
+    MONITOR_PUBLISH_SECONDS, and the combined summary merges the published states'''
+
+    def __init__(self, reference_path=None, publish_dir=None):
+        self.version = "1.0.0"
+        self.input_profile = DataProfile()
+        self.output_profile = DataProfile(['prediction'])
+        self.batches = 0
+        self.rows = 0
+        self.dropped_rows = 0
+        self.imputed = {column: 0 for column in IMPUTED_COLS}
+        self.reference = None
+        self.publish_dir = publish_dir
+        self.last_publish = 0.0
+        if reference_path:
+            self.load_reference(reference_path)
+        if publish_dir:
+            os.makedirs(publish_dir, exist_ok=True)
+
+    def update_quality(self, df: pd.DataFrame):
+        '''This function counts the negative or missing values the transformer is about to impute,
+        it has to run on the raw batch since the transformer changes the dataframe in place'''
+        columns = [column for column in IMPUTED_COLS if column in df.columns]
+        values = df[columns].to_numpy(dtype=np.float64)
+        imputed = (np.isnan(values) | (values < 0)).sum(axis=0)
+        for column, count in zip(columns, imputed):
+            self.imputed[column] += int(count)
+        self.batches += 1
+        self.rows += len(df)
+
+    def update(self, processed_data: pd.DataFrame, predictions, raw_rows):
+        '''This function folds a transformed batch and its predictions into the profiles,
+        raw_rows is the number of rows of the batch before the transformer dropped any'''
+        self.input_profile.update(processed_data)
+        self.output_profile.update(pd.DataFrame({'prediction': np.asarray(predictions, dtype=np.float64)}))
+        self.dropped_rows += raw_rows - len(processed_data)
+        if self.publish_dir and time.monotonic() - self.last_publish >= MONITOR_PUBLISH_SECONDS:
+            self.publish()
+
+    def merge(self, other):
+        '''This function merges the counters and profiles of another monitor into this one'''
+        self.batches += other.batches
+        self.rows += other.rows
+        self.dropped_rows += other.dropped_rows
+        for column, count in other.imputed.items():
+            self.imputed[column] = self.imputed.get(column, 0) + count
+        self.input_profile.merge(other.input_profile)
+        self.output_profile.merge(other.output_profile)
+
+    def publish(self):
+        '''This function writes the state of this worker to the shared directory'''
+        # a failed publish is retried at the next interval, not on every batch
+        self.last_publish = time.monotonic()
+        path = os.path.join(self.publish_dir, "worker_{}.json".format(os.getpid()))
+        with open(path + ".tmp", 'w') as f:
+            json.dump(self.to_dict(), f)
+        # replace the previous state atomically so readers never see a partial file
+        os.replace(path + ".tmp", path)
+
+    def combined_summary(self) -> dict:
+        '''This function returns the summary over all the workers that published their state,
+        the states of the other workers may be up to MONITOR_PUBLISH_SECONDS old'''
+        if not self.publish_dir:
+            summary = self.summary()
+            summary['workers'] = 1
+            return summary
+        self.publish()
+        combined = DataMonitor()
+        combined.reference = self.reference
+        paths = glob.glob(os.path.join(self.publish_dir, "worker_*.json"))
+        for path in paths:
+            with open(path) as f:
+                combined.merge(DataMonitor.from_dict(json.load(f)))
+        summary = combined.summary()
+        summary['workers'] = len(paths)
+        return summary
+
+    def to_dict(self) -> dict:
+        '''This function serializes the counters and profiles'''
+        return {
+            'batches': self.batches,
+            'rows': self.rows,
+            'dropped_rows': self.dropped_rows,
+            'imputed': self.imputed,
+            'inputs': self.input_profile.to_dict(),
+            'predictions': self.output_profile.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        '''This function rebuilds a monitor from its serialized form'''
+        monitor = cls()
+        monitor.batches = state['batches']
+        monitor.rows = state['rows']
+        monitor.dropped_rows = state['dropped_rows']
+        monitor.imputed = dict(state['imputed'])
+        monitor.input_profile = DataProfile.from_dict(state['inputs'])
+        monitor.output_profile = DataProfile.from_dict(state['predictions'])
+        return monitor
+
+    def summary(self) -> dict:
+        '''This function returns the data quality counters, the profiles and the drift from the reference'''
+        summary = {
+            'batches': self.batches,
+            'rows': self.rows,
+            'dropped_rows': self.dropped_rows,
+            'imputed': self.imputed,
+            'inputs': self.input_profile.summary(),
+            'predictions': self.output_profile.summary(),
+        }
+        if self.reference is not None:
+            summary['drift'] = {
+                'inputs': self.input_profile.compare(self.reference['inputs']),
+                'predictions': self.output_profile.compare(self.reference['predictions']),
+            }
+        return summary
+
+    def save_profile(self, path):
+        '''This function saves the input and prediction profiles, e.g. as the reference profile of a model'''
+        with open(path, 'w') as f:
+            json.dump({'inputs': self.input_profile.to_dict(), 'predictions': self.output_profile.to_dict()}, f)
+
+    def load_reference(self, path):
+        '''This function loads a reference profile saved with save_profile'''
+        try:
+            with open(path) as f:
+                profile = json.load(f)
+            self.reference = {key: DataProfile.from_dict(profile[key]) for key in ('inputs', 'predictions')}
+        except FileNotFoundError as error_message:
+            logging.error(error_message)
+            raise error_message
+
+
+def _population_stability_index(counts, reference_counts):
+    '''This function computes the PSI over bins holding equal shares of the reference distribution'''
+    reference_cumulative = np.cumsum(reference_counts)
+    edges = np.searchsorted(reference_cumulative, reference_cumulative[-1] * np.arange(1, PSI_BINS) / PSI_BINS,
+                            side='right')
+    edges = np.unique(np.concatenate([[0], edges]))
+    edges = edges[edges < len(counts)]
+    actual = np.add.reduceat(counts, edges) / max(counts.sum(), 1)
+    expected = np.add.reduceat(reference_counts, edges) / max(reference_counts.sum(), 1)
+    actual, expected = np.maximum(actual, 1e-6), np.maximum(expected, 1e-6)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def _to_json_float(value):
+    '''This function converts numpy floats for the JSON response, non finite values become None'''
+    value = float(value)
+    return value if np.isfinite(value) else None
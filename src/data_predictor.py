@@ -1,17 +1,25 @@
+import hashlib
 import logging
 import os
 import pickle
+import numpy as np
 from sklearn.linear_model import LinearRegression
 
 from consts.paths_and_numbers import MODEL_NAME
 
 class PurchasePredictor:
     '''This class is used to load the model and predict the purchase probability'''
-    def __init__(self, model_name = MODEL_NAME):
+    def __init__(self, model_name = MODEL_NAME, shared_state = None, prediction_cache = None):
         self.version = "1.0.0"
+        self.prediction_cache = prediction_cache
         try:
-            path = os.path.join(os.path.dirname(__file__), model_name)
-            self.model : LinearRegression = self.load_model(path)
+            if shared_state is not None:
+                # in multi-worker mode the coefficients were loaded once by the parent process
+                self.model : LinearRegression = shared_state.load_model()
+            else:
+                path = os.path.join(os.path.dirname(__file__), model_name)
+                self.model : LinearRegression = self.load_model(path)
+            self.model_version = self.get_model_version()
         except FileNotFoundError as error_message:
             logging.error(error_message)
             raise error_message
@@ -21,13 +29,36 @@ class PurchasePredictor:
         with open(model_path, 'rb') as f:
             model = pickle.load(f)
         return model
+
+    def reload_model(self, model_name = MODEL_NAME):
+        '''This method replaces the model, the cached predictions of the old model are invalidated'''
+        path = os.path.join(os.path.dirname(__file__), model_name)
+        self.model = self.load_model(path)
+        self.model_version = self.get_model_version()
+        if self.prediction_cache:
+            self.prediction_cache.invalidate()
+
+    def get_model_version(self):
+        '''This method returns a short hash of the model coefficients'''
+        coefficients = np.append(self.model.coef_, self.model.intercept_).astype(np.float64)
+        return hashlib.sha1(coefficients.tobytes()).hexdigest()[:12]
     
     def batch_predict(self, df):
         '''This method predicts the purchase probability for a batch of users'''
         try:
             #try to predict
             logging.info("Predicting batch")
-            predictions = self.model.predict(df)
+            if self.prediction_cache is None or df.empty:
+                predictions = self.model.predict(df)
+                return list(predictions)
+            # only the distinct rows that are not cached for this model version are sent to the model
+            hashes = self.prediction_cache.hash_rows(df)
+            predictions, missing = self.prediction_cache.lookup(hashes, self.model_version)
+            if missing.any():
+                unique_hashes, first, inverse = np.unique(hashes[missing], return_index=True, return_inverse=True)
+                new_predictions = self.model.predict(df.iloc[np.flatnonzero(missing)[first]])
+                predictions[missing] = new_predictions[inverse]
+                self.prediction_cache.insert(unique_hashes, new_predictions)
             return list(predictions)
         except Exception as error_message:
             #log error
@@ -3,33 +3,77 @@ import logging
 
 class ETPPipeline:
     '''This class is used to orchestrate the ETP pipeline'''
-    def __init__(self, data_transformer, data_predictor):
+    def __init__(self, data_transformer, data_predictor, data_monitor=None, pipeline_profiler=None):
         '''This function initializes the ETP pipeline'''
         self.data_extractor = None
         self.data_transformer = data_transformer
         self.data_predictor = data_predictor
+        self.data_monitor = data_monitor
+        self.pipeline_profiler = pipeline_profiler
+        self.runs_in_flight = 0
         self.version = "1.0.0"
 
     def set_data_extractor(self, data_extractor):
-        '''This function sets the data extractor'''
+        '''This function sets the data extractor and closes the consumer of the one it replaces'''
+        if self.data_extractor is not None and self.data_extractor is not data_extractor:
+            self.close_data_extractor()
         self.data_extractor = data_extractor
 
-    async def run(self, batch_size=100):
-        '''This function runs the ETP pipeline'''
+    def close_data_extractor(self):
+        '''This function closes the consumer of the data extractor, a recorder flushes its segment on close'''
+        kafka_consumer = getattr(self.data_extractor, 'kafka_consumer', None)
+        if hasattr(kafka_consumer, 'close'):
+            try:
+                kafka_consumer.close()
+            except Exception as error_message:
+                logging.error(error_message)
+
+    async def run(self, batch_size=100, request_id=None, profile=False):
+        '''This function runs the ETP pipeline, profiled when requested or sampled by the profiler'''
+        if self.pipeline_profiler and self.pipeline_profiler.should_profile(profile, self.runs_in_flight):
+            coroutine = self.pipeline_profiler.profile(self._run(batch_size), batch_size, request_id)
+        else:
+            if self.pipeline_profiler:
+                self.pipeline_profiler.note_concurrent_run()
+            coroutine = self._run(batch_size)
+        # the profiler only profiles a run while no other run is in flight
+        self.runs_in_flight += 1
+        try:
+            return await coroutine
+        finally:
+            self.runs_in_flight -= 1
+
+    async def _run(self, batch_size):
+        '''This function extracts, transforms and predicts a single batch'''
         try:
             # try to run the ETP pipeline
             logging.info("Running ETP pipeline")
             # extract data
             data = await self.data_extractor.extract_data(batch_size)
+            # count what the transformer is about to impute before it changes the data in place
+            raw_rows = len(data)
+            self._update_monitor('update_quality', data)
             # transform data
             processed_data, user_ids_for_prediction, corrupt_data_user_ids = self.data_transformer.transform_data(
                 data)
             # predict on data
             predictions = self.data_predictor.batch_predict(processed_data)
             result_dict = dict(zip(user_ids_for_prediction, predictions))
+            # update the streaming statistics of the model inputs and outputs
+            self._update_monitor('update', processed_data, predictions, raw_rows)
             
             return result_dict, corrupt_data_user_ids
         except Exception as error_message:
             # log error
             logging.error(error_message)
             return None
+
+    def _update_monitor(self, method, *args):
+        '''This function updates the data monitor, a failed update is logged and the batch goes on'''
+        if not self.data_monitor:
+            return
+        try:
+            getattr(self.data_monitor, method)(*args)
+        except Exception as error_message:
+            # monitoring must never break the predictions
+            logging.error(error_message)
@@ -0,0 +1,185 @@
+# classes to record the kafka stream to local segment files and to replay it without kafka
+import asyncio
+import glob
+import heapq
+import logging
+import os
+import struct
+import time
+import uuid
+from collections import namedtuple
+
+from consts.paths_and_numbers import RECORD_FLUSH_EVERY, REPLAY_SEGMENT_MAX_BYTES
+
+SEGMENT_MAGIC = b"MAREC001"
+# timestamp in ms, partition, offset, topic length and value length
+RECORD_HEADER = struct.Struct("<qiqHI")
+
+ReplayMessage = namedtuple("ReplayMessage", ["topic", "partition", "offset", "timestamp", "value"])
+
+
+class KafkaRecorder:
+    '''This class wraps a kafka consumer and writes every consumed message to segment files,
+    it is iterated exactly like the consumer so it can be given to the DataExtractor as is'''
+
+    def __init__(self, kafka_consumer, directory, segment_max_bytes=REPLAY_SEGMENT_MAX_BYTES):
+        self.kafka_consumer = kafka_consumer
+        self.messages = iter(kafka_consumer)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.version = "1.0.0"
+        # several workers and several recorders of one worker may record into the same directory,
+        # so the segments are named by start time, process and recorder
+        self.segment_prefix = "segment_{}_{}_{}_".format(int(time.time() * 1000), os.getpid(), uuid.uuid4().hex[:8])
+        self.segment_number = 0
+        self.segment_file = None
+        self.segment_size = 0
+        self.unflushed = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        msg = next(self.messages)
+        try:
+            self.write(msg)
+        except Exception as error_message:
+            # recording must never break the predictions
+            logging.error(error_message)
+        return msg
+
+    def write(self, msg):
+        '''This function appends a message to the current segment file'''
+        topic = getattr(msg, 'topic', '').encode()
+        value = _to_bytes(msg.value)
+        record = RECORD_HEADER.pack(
+            int(getattr(msg, 'timestamp', None) or time.time() * 1000),
+            int(getattr(msg, 'partition', None) or 0),
+            int(getattr(msg, 'offset', None) or 0),
+            len(topic), len(value)) + topic + value
+        if self.segment_file is None or self.segment_size + len(record) > self.segment_max_bytes:
+            self._open_segment()
+        self.segment_file.write(record)
+        self.segment_size += len(record)
+        self.unflushed += 1
+        if self.unflushed >= RECORD_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        '''This function flushes the current segment file to disk'''
+        if self.segment_file:
+            self.segment_file.flush()
+        self.unflushed = 0
+
+    def close(self):
+        '''This function closes the current segment file and the wrapped consumer'''
+        self._close_segment()
+        if hasattr(self.kafka_consumer, 'close'):
+            self.kafka_consumer.close()
+
+    def _close_segment(self):
+        if self.segment_file:
+            self.segment_file.close()
+            self.segment_file = None
+
+    def _open_segment(self):
+        self._close_segment()
+        path = os.path.join(self.directory, "{}{:05d}.bin".format(self.segment_prefix, self.segment_number))
+        # never overwrite an existing recording
+        self.segment_file = open(path, 'xb')
+        self.segment_file.write(SEGMENT_MAGIC)
+        self.segment_size = len(SEGMENT_MAGIC)
+        self.segment_number += 1
+        logging.info("recording kafka stream to {}".format(path))
+
+
+class ReplayConsumer:
+    '''This class replays recorded segment files merged by message timestamp, so recordings of
+    several workers interleave like the original traffic, at the original timing (speed 1),
+    N times faster (speed N) or as fast as possible (speed 0). The DataExtractor iterates it
+    asynchronously, so the wait for a message does not block other requests of the worker. A single consumer replays the whole
+    recording, so the service only allows a replay when it runs with a single worker'''
+
+    def __init__(self, directory, speed=1.0, loop=False):
+        self.directory = directory
+        self.speed = speed
+        self.loop = loop
+        self.version = "1.0.0"
+        self.segment_paths = sorted(glob.glob(os.path.join(directory, "segment_*.bin")))
+        if not self.segment_paths:
+            raise FileNotFoundError("No recorded segments found in {}".format(directory))
+        self.messages = self._read_messages()
+        self.first_timestamp = None
+        self.start_time = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        msg = next(self.messages)
+        delay = self._delay(msg)
+        if delay > 0:
+            time.sleep(delay)
+        return msg
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        '''This function returns the next message, waiting for it without blocking the event loop'''
+        try:
+            msg = next(self.messages)
+        except StopIteration:
+            raise StopAsyncIteration
+        delay = self._delay(msg)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return msg
+
+    def _delay(self, msg):
+        '''This function returns the seconds until the message is due relative to the first replayed message'''
+        if not self.speed:
+            return 0
+        if self.first_timestamp is None:
+            self.first_timestamp, self.start_time = msg.timestamp, time.monotonic()
+        return (msg.timestamp - self.first_timestamp) / 1000 / self.speed - (time.monotonic() - self.start_time)
+
+    def _read_messages(self):
+        while True:
+            # ties are broken by the sorted segment order, so the replay is deterministic
+            yield from heapq.merge(*[read_segment(path) for path in self.segment_paths],
+                                   key=lambda msg: msg.timestamp)
+            if not self.loop:
+                return
+            # restart the timing from the first message of the next pass
+            self.first_timestamp = None
+
+
+def read_segment(path):
+    '''This function yields the messages of a single segment file, reading it as it goes'''
+    with open(path, 'rb') as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError("{} is not a recorded kafka segment".format(path))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                if header:
+                    logging.warning("truncated record at the end of {}".format(path))
+                return
+            timestamp, partition, offset, topic_length, value_length = RECORD_HEADER.unpack(header)
+            body = f.read(topic_length + value_length)
+            if len(body) < topic_length + value_length:
+                # the recorder stopped in the middle of a record
+                logging.warning("truncated record at the end of {}".format(path))
+                return
+            yield ReplayMessage(body[:topic_length].decode(), partition, offset, timestamp, body[topic_length:])
+
+
+def _to_bytes(value):
+    '''This function returns the raw bytes of a message value'''
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    raise TypeError("Only raw message values can be recorded, got {}".format(type(value).__name__))
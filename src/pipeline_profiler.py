@@ -0,0 +1,185 @@
+# a class for profiling single runs of the ETP pipeline in production
+import cProfile
+import glob
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from collections import deque
+
+from consts.paths_and_numbers import PROFILE_RING_SIZE, PROFILE_TOP_ENTRIES
+
+
+class PipelineProfiler:
+    '''This class captures a CPU profile and an allocation snapshot of a pipeline run, when it is
+    requested or sampled, and keeps the last profiles in a bounded ring buffer. The ring buffer is
+    in memory, or in a directory when several workers share it.
+    cProfile and tracemalloc observe the whole process, so a run is only profiled when no other
+    pipeline run is in flight. Runs that start while the profile is taken still end up in it, their
+    number is stored with the profile as concurrent_runs'''
+
+    def __init__(self, max_profiles=PROFILE_RING_SIZE, sample_rate=0.0, directory=None):
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.profiles = deque(maxlen=max_profiles)
+        self.version = "1.0.0"
+        # only one cProfile profiler can be enabled at a time
+        self.active = False
+        self.concurrent_runs = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def should_profile(self, requested=False, other_runs=0) -> bool:
+        '''This function decides if a run is profiled, either on request or by sampling'''
+        if self.active or other_runs:
+            return False
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def note_concurrent_run(self):
+        '''This function counts a pipeline run that started while a profile is taken'''
+        if self.active:
+            self.concurrent_runs += 1
+
+    async def profile(self, coroutine, batch_size, request_id=None):
+        '''This function awaits the coroutine while profiling it and stores the profile,
+        if the profiler can not be started the coroutine runs without it'''
+        self.active = True
+        self.concurrent_runs = 0
+        started_tracemalloc = False
+        profiler = None
+        try:
+            started_tracemalloc = not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            start_snapshot = tracemalloc.take_snapshot()
+            profiler = cProfile.Profile()
+            started_at = time.time()
+            start = time.perf_counter()
+            profiler.enable()
+        except Exception as error_message:
+            # a failed profile must never fail the predictions
+            logging.error(error_message)
+            if profiler is not None:
+                profiler.disable()
+            self._release(started_tracemalloc)
+            return await coroutine
+        try:
+            return await coroutine
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            try:
+                self._store({
+                    'request_id': request_id,
+                    'worker_pid': os.getpid(),
+                    'batch_size': batch_size,
+                    'started_at': started_at,
+                    'duration_seconds': duration,
+                    'concurrent_runs': self.concurrent_runs,
+                    'peak_memory_bytes': tracemalloc.get_traced_memory()[1],
+                    'cpu_profile': self._cpu_profile_bytes(profiler),
+                    'cpu_summary': self._cpu_summary(profiler),
+                    'allocations': self._allocations_summary(tracemalloc.take_snapshot(), start_snapshot),
+                })
+                logging.info("profiled ETP pipeline run {} in {:.3f}s".format(request_id, duration))
+            except Exception as error_message:
+                logging.error(error_message)
+            finally:
+                self._release(started_tracemalloc)
+
+    def _release(self, started_tracemalloc):
+        '''This function stops the tracing this profiler started and lets the next run be profiled'''
+        if started_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.active = False
+
+    def list_profiles(self) -> list:
+        '''This function returns the metadata of the stored profiles, newest first'''
+        if self.directory:
+            profiles = []
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                try:
+                    with open(path) as f:
+                        profiles.append(json.load(f))
+                except (FileNotFoundError, ValueError):
+                    # pruned or being written by another worker
+                    continue
+            profiles.sort(key=lambda profile: profile['started_at'], reverse=True)
+        else:
+            profiles = list(reversed(self.profiles))
+        return [
+            {key: value for key, value in profile.items() if key not in ('cpu_profile', 'cpu_summary', 'allocations')}
+            for profile in profiles
+        ]
+
+    def get_profile(self, request_id):
+        '''This function returns the stored profile of a request, or None'''
+        if self.directory:
+            path = os.path.join(self.directory, str(request_id))
+            try:
+                with open(path + ".json") as f:
+                    profile = json.load(f)
+                with open(path + ".prof", 'rb') as f:
+                    profile['cpu_profile'] = f.read()
+                return profile
+            except FileNotFoundError:
+                return None
+        for profile in reversed(self.profiles):
+            if profile['request_id'] == request_id:
+                return profile
+        return None
+
+    def _store(self, profile):
+        '''This function adds a profile to the ring buffer'''
+        if not self.directory:
+            self.profiles.append(profile)
+            return
+        name = profile['request_id'] if profile['request_id'] is not None else "run_{}_{}".format(
+            profile['worker_pid'], int(profile['started_at'] * 1000))
+        path = os.path.join(self.directory, str(name))
+        with open(path + ".prof", 'wb') as f:
+            f.write(profile['cpu_profile'])
+        with open(path + ".json.tmp", 'w') as f:
+            json.dump({key: value for key, value in profile.items() if key != 'cpu_profile'}, f)
+        # the metadata is written last and atomically, so a listed profile can always be downloaded
+        os.replace(path + ".json.tmp", path + ".json")
+        # drop the oldest profiles of all the workers beyond the ring size
+        paths = sorted(glob.glob(os.path.join(self.directory, "*.json")), key=_modified_time)
+        for old_path in paths[:max(len(paths) - self.max_profiles, 0)]:
+            for old_file in (old_path, old_path[:-len(".json")] + ".prof"):
+                try:
+                    os.remove(old_file)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _cpu_profile_bytes(profiler) -> bytes:
+        '''This function serializes the profile in the pstats file format, readable by pstats or snakeviz'''
+        profiler.create_stats()
+        return marshal.dumps(profiler.stats)
+
+    @staticmethod
+    def _cpu_summary(profiler) -> str:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+        return stream.getvalue()
+
+    @staticmethod
+    def _allocations_summary(snapshot, start_snapshot) -> str:
+        statistics = snapshot.compare_to(start_snapshot, 'lineno')[:PROFILE_TOP_ENTRIES]
+        return "\n".join(str(statistic) for statistic in statistics)
+
+
+def _modified_time(path):
+    '''This function returns the modification time of a file, 0 when another worker removed it'''
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
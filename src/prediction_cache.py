@@ -0,0 +1,138 @@
+# a class for caching predictions of identical feature rows
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+from consts.paths_and_numbers import PREDICTION_CACHE_EVICT_FRACTION, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL
+
+
+class PredictionCache:
+    '''This class is a bounded cache from a hash of a transformed feature row to its prediction.
+    A dict maps the hashes to slots of fixed size numpy arrays, so the cost of a batch does not
+    depend on the cache size. Entries expire after a TTL, when the cache is full expired entries
+    are reclaimed before the least recently used ones, and the whole cache is invalidated when
+    the model version changes'''
+
+    def __init__(self, max_size=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL):
+        if max_size <= 0:
+            raise ValueError("The prediction cache size must be positive")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.version = "1.0.0"
+        self.model_version = None
+        self.keys = np.zeros(max_size, dtype=np.uint64)
+        self.values = np.zeros(max_size, dtype=np.float64)
+        self.expires = np.zeros(max_size, dtype=np.float64)
+        self.last_used = np.zeros(max_size, dtype=np.int64)
+        self.slots = {}
+        self.free_slots = list(range(max_size - 1, -1, -1))
+        # a full cache reclaims this many slots at once, so the scan over all the slots is amortized
+        self.evict_chunk = max(1, int(max_size * PREDICTION_CACHE_EVICT_FRACTION))
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def hash_rows(df: pd.DataFrame) -> np.ndarray:
+        '''This function hashes the float64 bits of every feature row, one vectorized step per column'''
+        # adding 0.0 turns -0.0 into 0.0 so equal values always have equal bits
+        bits = np.ascontiguousarray(df.to_numpy(dtype=np.float64) + 0.0).view(np.uint64)
+        hashes = np.full(len(bits), 0xcbf29ce484222325, dtype=np.uint64)
+        for column in bits.T:
+            hashes = (hashes ^ column) * np.uint64(0x100000001b3)
+            hashes ^= hashes >> np.uint64(29)
+        # splitmix64 finalizer to spread every input bit over the whole hash
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xbf58476d1ce4e5b9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94d049bb133111eb)
+        hashes ^= hashes >> np.uint64(31)
+        return hashes
+
+    def lookup(self, hashes, model_version):
+        '''This function returns the cached predictions (nan for misses) and a mask of the misses'''
+        if model_version != self.model_version:
+            self.invalidate()
+            self.model_version = model_version
+        self.tick += 1
+        slots = self._find(hashes)
+        hit = slots >= 0
+        hit[hit] = self.expires[slots[hit]] > time.monotonic()
+        predictions = np.full(len(hashes), np.nan)
+        predictions[hit] = self.values[slots[hit]]
+        self.last_used[slots[hit]] = self.tick
+        self.hits += int(hit.sum())
+        self.misses += int((~hit).sum())
+        return predictions, ~hit
+
+    def insert(self, hashes, predictions):
+        '''This function stores new predictions, reusing the slots of expired entries with the same key'''
+        hashes, first = np.unique(hashes, return_index=True)
+        predictions = np.asarray(predictions, dtype=np.float64)[first]
+        if len(hashes) > self.max_size:
+            hashes, predictions = hashes[-self.max_size:], predictions[-self.max_size:]
+        slots = self._find(hashes)
+        new = slots < 0
+        slots[new] = self._allocate(int(new.sum()), protected=slots[~new])
+        self.keys[slots] = hashes
+        self.values[slots] = predictions
+        self.expires[slots] = time.monotonic() + self.ttl_seconds
+        self.last_used[slots] = self.tick
+        self.slots.update(zip(hashes[new].tolist(), slots[new].tolist()))
+
+    def invalidate(self):
+        '''This function drops every entry, e.g. after the model was reloaded'''
+        if self.slots:
+            self.invalidations += 1
+            logging.info("invalidating the prediction cache")
+        self.slots = {}
+        self.free_slots = list(range(self.max_size - 1, -1, -1))
+
+    def stats(self) -> dict:
+        '''This function returns the hit rate metrics of the cache'''
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.slots),
+            'max_size': self.max_size,
+            'ttl_seconds': self.ttl_seconds,
+            'model_version': self.model_version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def _find(self, hashes):
+        '''This function returns the slot of every hash, or -1 when the hash is not cached'''
+        get = self.slots.get
+        return np.fromiter((get(key, -1) for key in hashes.tolist()), dtype=np.int64, count=len(hashes))
+
+    def _allocate(self, count, protected):
+        '''This function returns free slots, reclaiming used ones when there are not enough'''
+        if len(self.free_slots) < count:
+            self._reclaim(count - len(self.free_slots), protected)
+        allocated = self.free_slots[-count:] if count else []
+        del self.free_slots[len(self.free_slots) - count:]
+        return np.array(allocated, dtype=np.int64)
+
+    def _reclaim(self, needed, protected):
+        '''This function frees at least the needed slots, expired entries first and then the least
+        recently used ones. The slots updated by the current insert are never reclaimed'''
+        priority = np.where(self.expires <= time.monotonic(), -1, self.last_used)
+        priority[protected] = np.iinfo(np.int64).max
+        priority[self.free_slots] = np.iinfo(np.int64).max
+        available = self.max_size - len(protected) - len(self.free_slots)
+        chunk = min(max(needed, self.evict_chunk), available)
+        reclaimed = np.argpartition(priority, chunk - 1)[:chunk]
+        expired = int((priority[reclaimed] < 0).sum())
+        self.expirations += expired
+        self.evictions += chunk - expired
+        for key in self.keys[reclaimed].tolist():
+            del self.slots[key]
+        self.free_slots.extend(reclaimed.tolist())
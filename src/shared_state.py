@@ -0,0 +1,158 @@
+# a class for sharing state between the uvicorn workers of the prediction service
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+from multiprocessing import shared_memory
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+from consts.paths_and_numbers import SHARED_CONFIG_MAX_BYTES, SHARED_META_MAX_BYTES
+
+# every blob segment starts with a version and a payload length, both int64
+BLOB_HEADER_SIZE = 16
+
+
+class SharedState:
+    '''This class holds the model coefficients, the request id counter and the data resource
+    configuration in shared memory segments, so every worker process sees the same state'''
+
+    def __init__(self, name, create=False, model=None):
+        '''This function creates (in the parent process) or attaches (in a worker) the shared segments'''
+        self.name = name
+        self.owner = create
+        self.version = "1.0.0"
+        # a lock file is used to make updates to the counter and the config atomic across processes
+        self.lock_path = os.path.join(tempfile.gettempdir(), "{}.lock".format(name))
+        # a directory for state the workers exchange through files, e.g. the data statistics
+        self.work_dir = os.path.join(tempfile.gettempdir(), name)
+        try:
+            if create:
+                if model is None:
+                    raise ValueError("A model is required to create the shared state")
+                model_size = (len(model.coef_) + 1) * np.dtype(np.float64).itemsize
+                self.model_shm = shared_memory.SharedMemory(name + "_model", create=True, size=model_size)
+                self.meta_shm = shared_memory.SharedMemory(
+                    name + "_meta", create=True, size=BLOB_HEADER_SIZE + SHARED_META_MAX_BYTES)
+                self.counter_shm = shared_memory.SharedMemory(
+                    name + "_counter", create=True, size=np.dtype(np.int64).itemsize)
+                self.config_shm = shared_memory.SharedMemory(
+                    name + "_config", create=True, size=BLOB_HEADER_SIZE + SHARED_CONFIG_MAX_BYTES)
+                open(self.lock_path, 'a').close()
+                os.makedirs(self.work_dir, exist_ok=True)
+                # first slot is the intercept and the rest are the coefficients
+                coefficients = np.ndarray((len(model.coef_) + 1,), dtype=np.float64, buffer=self.model_shm.buf)
+                coefficients[0] = model.intercept_
+                coefficients[1:] = model.coef_
+                self.counter_shm.buf[:] = bytes(self.counter_shm.size)
+                self.config_shm.buf[:BLOB_HEADER_SIZE] = bytes(BLOB_HEADER_SIZE)
+                feature_names = [str(x) for x in getattr(model, 'feature_names_in_', [])]
+                self._write_blob(self.meta_shm, json.dumps({'feature_names': feature_names}).encode())
+            else:
+                self.model_shm = shared_memory.SharedMemory(name + "_model")
+                self.meta_shm = shared_memory.SharedMemory(name + "_meta")
+                self.counter_shm = shared_memory.SharedMemory(name + "_counter")
+                self.config_shm = shared_memory.SharedMemory(name + "_config")
+            self.counter = np.ndarray((1,), dtype=np.int64, buffer=self.counter_shm.buf)
+        except Exception as error_message:
+            logging.error(error_message)
+            raise error_message
+
+    def load_model(self) -> LinearRegression:
+        '''This function builds a model whose coefficients are a view on the shared segment'''
+        meta = json.loads(self._read_blob(self.meta_shm)[1])
+        coefficients = np.ndarray((self.model_shm.size // np.dtype(np.float64).itemsize,),
+                                  dtype=np.float64, buffer=self.model_shm.buf)
+        model = LinearRegression()
+        model.intercept_ = float(coefficients[0])
+        model.coef_ = coefficients[1:]
+        model.n_features_in_ = len(model.coef_)
+        if meta['feature_names']:
+            model.feature_names_in_ = np.array(meta['feature_names'], dtype=object)
+        return model
+
+    def next_request_id(self) -> int:
+        '''This function atomically returns the current request id and increments the shared counter'''
+        with self._locked():
+            request_id = int(self.counter[0])
+            self.counter[0] = request_id + 1
+        return request_id
+
+    def publish_config(self, config: dict) -> int:
+        '''This function broadcasts the data resource configuration to all workers'''
+        payload = json.dumps(config).encode()
+        if len(payload) > self.config_shm.size - BLOB_HEADER_SIZE:
+            raise ValueError("Data resource configuration is larger than {} bytes".format(SHARED_CONFIG_MAX_BYTES))
+        with self._locked():
+            version = self._read_header(self.config_shm)[0] + 1
+            self._write_blob(self.config_shm, payload, version)
+        return version
+
+    def config_version(self) -> int:
+        '''This function returns the latest configuration version without taking the lock,
+        a single aligned int64 is read so the cheap check on every request never blocks on other workers'''
+        return self._read_header(self.config_shm)[0]
+
+    def read_config(self):
+        '''This function returns the latest configuration version and the configuration, or (0, None)'''
+        with self._locked():
+            version, payload = self._read_blob(self.config_shm)
+        if version == 0:
+            return 0, None
+        return version, json.loads(payload)
+
+    def close(self):
+        '''This function detaches from the shared segments and removes them if this process created them'''
+        # drop the numpy views before closing, otherwise the buffers are still exported
+        self.counter = None
+        for shm in (self.model_shm, self.meta_shm, self.counter_shm, self.config_shm):
+            shm.close()
+            if self.owner:
+                shm.unlink()
+        if self.owner and os.path.exists(self.lock_path):
+            os.remove(self.lock_path)
+        if self.owner:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _locked(self):
+        '''This function returns a context manager holding the cross process lock'''
+        return _FileLock(self.lock_path)
+
+    @staticmethod
+    def _read_header(shm):
+        header = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        version, length = int(header[0]), int(header[1])
+        del header
+        return version, length
+
+    @classmethod
+    def _read_blob(cls, shm):
+        version, length = cls._read_header(shm)
+        return version, bytes(shm.buf[BLOB_HEADER_SIZE:BLOB_HEADER_SIZE + length])
+
+    @staticmethod
+    def _write_blob(shm, payload, version=1):
+        shm.buf[BLOB_HEADER_SIZE:BLOB_HEADER_SIZE + len(payload)] = payload
+        header = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        header[0], header[1] = version, len(payload)
+        del header
+
+
+class _FileLock:
+    '''An exclusive flock on a file, usable from unrelated processes'''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from src.data_monitor import DataMonitor, DataProfile
+from src.etp_orchestrator import ETPPipeline
+
+
+@pytest.fixture
+def mock_batches():
+    '''This function creates a few batches of normally distributed data'''
+    rng = np.random.default_rng(0)
+    return [pd.DataFrame({
+        'a': rng.normal(10, 2, 500),
+        'b': rng.normal(-5, 1, 500),
+    }) for i in range(4)]
+
+
+def test_profile_moments(mock_batches):
+    '''This test checks that the streamed moments match the moments of the full data'''
+    profile = DataProfile()
+    for batch in mock_batches:
+        profile.update(batch)
+    full = pd.concat(mock_batches)
+    assert profile.count.tolist() == [2000, 2000]
+    assert np.allclose(profile.mean, full.mean().values)
+    assert np.allclose(profile.variance(), full.var().values)
+    assert np.allclose(profile.min, full.min().values)
+    assert np.allclose(profile.max, full.max().values)
+
+
+def test_profile_quantiles(mock_batches):
+    '''This test checks that the sketch quantiles are within the relative accuracy'''
+    profile = DataProfile()
+    for batch in mock_batches:
+        profile.update(batch)
+    full = pd.concat(mock_batches)
+    expected = full.quantile([0.5, 0.9, 0.99]).values.T
+    assert np.allclose(profile.quantiles(), expected, rtol=0.03)
+
+
+def test_profile_merge_and_serialization(mock_batches):
+    '''This test checks that merged and reloaded profiles equal a profile of the whole stream'''
+    full_profile, first, second = DataProfile(), DataProfile(), DataProfile()
+    for i, batch in enumerate(mock_batches):
+        full_profile.update(batch)
+        (first if i % 2 else second).update(batch)
+    first.merge(DataProfile.from_dict(second.to_dict()))
+    assert np.allclose(first.mean, full_profile.mean)
+    assert np.allclose(first.m2, full_profile.m2)
+    assert (first.sketch == full_profile.sketch).all()
+
+
+def test_profile_missing_values():
+    '''This test checks that missing values are counted and left out of the statistics'''
+    profile = DataProfile()
+    profile.update(pd.DataFrame({'a': [1.0, np.nan, 3.0]}))
+    summary = profile.summary()
+    assert summary['a']['count'] == 2
+    assert summary['a']['missing'] == 1
+    assert summary['a']['mean'] == 2.0
+
+
+def test_profile_drift(mock_batches):
+    '''This test checks that a shifted stream shows drift against the reference and an equal one does not'''
+    reference, same, shifted = DataProfile(), DataProfile(), DataProfile()
+    for batch in mock_batches[:2]:
+        reference.update(batch)
+    for batch in mock_batches[2:]:
+        same.update(batch)
+        shifted.update(batch + 3)
+    assert same.compare(reference)['a']['psi'] < 0.1
+    drift = shifted.compare(reference)
+    assert drift['a']['psi'] > 0.25
+    assert drift['b']['mean_shift'] > 2
+
+
+def test_data_monitor_summary(tmp_path):
+    '''This test checks the data quality counters and the drift against a saved reference profile'''
+    monitor = DataMonitor()
+    raw = pd.DataFrame({
+        'time_spent_1': [-1, 10, np.nan],
+        'days_since_last_purchase': [3, -2, 5],
+    })
+    monitor.update_quality(raw)
+    monitor.update(pd.DataFrame({'time_spent_1': [0.0, 10.0]}), [0.1, 0.2], len(raw))
+    path = tmp_path / 'reference_profile.json'
+    monitor.save_profile(path)
+    summary = DataMonitor(path).summary()
+    assert summary['batches'] == 0
+    summary = monitor.summary()
+    assert summary['imputed']['time_spent_1'] == 2
+    assert summary['imputed']['days_since_last_purchase'] == 1
+    assert summary['dropped_rows'] == 1
+    assert summary['predictions']['prediction']['count'] == 2
+    monitor.load_reference(path)
+    assert 'drift' in monitor.summary()
+
+
+def test_data_monitor_missing_reference():
+    '''This test checks that a missing reference profile raises an error'''
+    with pytest.raises(FileNotFoundError):
+        DataMonitor('invalid')
+
+
+def test_data_monitor_combined_summary(mock_batches, tmp_path, monkeypatch: pytest.MonkeyPatch):
+    '''This test checks that the summary merges the states published by all the workers'''
+    workers = [DataMonitor(publish_dir=tmp_path) for i in range(2)]
+    single = DataMonitor()
+    for i, batch in enumerate(mock_batches):
+        # every worker publishes under its own process id
+        monkeypatch.setattr(os, 'getpid', lambda: 1000 + i % 2)
+        for monitor in (workers[i % 2], single):
+            monitor.update_quality(batch)
+            monitor.update(batch, batch['a'] / 10, len(batch) + 1)
+    # publish the latest state of the second worker, the first one publishes its own when asked
+    monkeypatch.setattr(os, 'getpid', lambda: 1001)
+    workers[1].publish()
+    monkeypatch.setattr(os, 'getpid', lambda: 1000)
+    summary = workers[0].combined_summary()
+    expected = single.summary()
+    assert summary['workers'] == 2
+    assert summary['rows'] == expected['rows']
+    assert summary['dropped_rows'] == 4
+    for column in ('a', 'b'):
+        assert summary['inputs'][column]['count'] == expected['inputs'][column]['count']
+        assert summary['inputs'][column]['quantiles'] == expected['inputs'][column]['quantiles']
+        assert summary['inputs'][column]['mean'] == pytest.approx(expected['inputs'][column]['mean'])
+        assert summary['inputs'][column]['variance'] == pytest.approx(expected['inputs'][column]['variance'])
+    assert summary['predictions']['prediction']['count'] == expected['predictions']['prediction']['count']
+
+
+#create a mock class for the data extractor
+class MockDataExtractor:
+    def __init__(self, batches):
+        self.batches = iter(batches)
+
+    async def extract_data(self, batch_size):
+        await asyncio.sleep(0)
+        return next(self.batches)
+
+
+#create a mock class for the data transformer
+class MockDataTransformer:
+    def transform_data(self, data):
+        return data, list(range(len(data))), set()
+
+
+#create a mock class for the data predictor
+class MockDataPredictor:
+    def batch_predict(self, data):
+        return np.zeros(len(data))
+
+
+@pytest.mark.asyncio
+async def test_data_monitor_failure_keeps_predictions(mock_batches, tmp_path):
+    '''This test checks that a failed publish of the statistics does not fail the batch'''
+    publish_dir = tmp_path / 'data_statistics'
+    monitor = DataMonitor(publish_dir=publish_dir)
+    pipeline = ETPPipeline(MockDataTransformer(), MockDataPredictor(), data_monitor=monitor)
+    pipeline.set_data_extractor(MockDataExtractor(mock_batches))
+    shutil.rmtree(publish_dir)
+    result_dict, corrupt_data_user_ids = await pipeline.run(500)
+    assert len(result_dict) == 500
+    assert monitor.batches == 1
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from src.data_extractor import DataExtractor
+from src.etp_orchestrator import ETPPipeline
+from src.kafka_replay import KafkaRecorder, ReplayConsumer, read_segment
+
+
+#create a mock class for the kafka consumer record
+class MockRecord:
+    def __init__(self, offset, timestamp, value):
+        self.topic = 'events'
+        self.partition = 0
+        self.offset = offset
+        self.timestamp = timestamp
+        self.value = value
+
+
+@pytest.fixture
+def mock_kafka_consumer():
+    '''This function creates a mock Kafka consumer with raw message bytes 10ms apart'''
+    return [
+        MockRecord(i, 1000 + 10 * i, json.dumps({
+            'user_id': int(np.random.randint(1, 1000)),
+            'last_page_1': 1,
+            'last_page_2': 2,
+            'last_page_3': 3,
+            'time_spent_1': int(np.random.randint(1, 100)),
+            'time_spent_2': int(np.random.randint(1, 100)),
+            'time_spent_3': int(np.random.randint(1, 100))
+        }).encode()) for i in range(20)
+    ]
+
+
+def record(mock_kafka_consumer, directory, **kwargs):
+    '''This function records all the messages of the mock consumer'''
+    recorder = KafkaRecorder(mock_kafka_consumer, directory, **kwargs)
+    recorded = list(recorder)
+    recorder.close()
+    return recorded
+
+
+def test_record_and_replay(mock_kafka_consumer, tmp_path):
+    '''This test checks that the replay returns the recorded messages in order'''
+    recorded = record(mock_kafka_consumer, tmp_path)
+    assert recorded == mock_kafka_consumer
+    replayed = list(ReplayConsumer(tmp_path, speed=0))
+    assert [msg.offset for msg in replayed] == list(range(20))
+    assert [msg.value for msg in replayed] == [msg.value for msg in mock_kafka_consumer]
+    assert [msg.timestamp for msg in replayed] == [msg.timestamp for msg in mock_kafka_consumer]
+
+
+def test_segment_rotation(mock_kafka_consumer, tmp_path):
+    '''This test checks that the recording is split into segments of bounded size'''
+    record(mock_kafka_consumer, tmp_path, segment_max_bytes=1000)
+    segments = sorted(tmp_path.glob('segment_*.bin'))
+    assert len(segments) > 1
+    assert all(path.stat().st_size <= 1000 for path in segments)
+    assert sum(len(list(read_segment(path))) for path in segments) == 20
+
+
+def test_replay_timing(mock_kafka_consumer, tmp_path):
+    '''This test checks that the replay keeps the original timing divided by the speed'''
+    record(mock_kafka_consumer, tmp_path)
+    start = time.monotonic()
+    list(ReplayConsumer(tmp_path, speed=1))
+    original = time.monotonic() - start
+    start = time.monotonic()
+    list(ReplayConsumer(tmp_path, speed=10))
+    faster = time.monotonic() - start
+    assert original >= 0.19
+    assert faster < original / 2
+
+
+def test_replay_loop(mock_kafka_consumer, tmp_path):
+    '''This test checks that a looping replay starts over after the last message'''
+    record(mock_kafka_consumer, tmp_path)
+    consumer = ReplayConsumer(tmp_path, speed=0, loop=True)
+    offsets = [next(consumer).offset for i in range(30)]
+    assert offsets == list(range(20)) + list(range(10))
+
+
+def test_replay_truncated_segment(mock_kafka_consumer, tmp_path):
+    '''This test checks that a partially written last record is skipped'''
+    record(mock_kafka_consumer, tmp_path)
+    path = next(tmp_path.glob('segment_*.bin'))
+    path.write_bytes(path.read_bytes()[:-5])
+    assert len(list(ReplayConsumer(tmp_path, speed=0))) == 19
+
+
+def test_replay_missing_directory(tmp_path):
+    '''This test checks that replaying a directory without segments raises an error'''
+    with pytest.raises(FileNotFoundError):
+        ReplayConsumer(tmp_path / 'invalid')
+
+
+@pytest.mark.asyncio
+async def test_replay_data_extractor(mock_kafka_consumer, tmp_path):
+    '''This test checks that the data extractor reads batches from a replay consumer'''
+    record(mock_kafka_consumer, tmp_path)
+    data_extractor = DataExtractor(ReplayConsumer(tmp_path, speed=0), None)
+    first = await data_extractor.extract_kafka_data(batch_size=15)
+    second = await data_extractor.extract_kafka_data(batch_size=15)
+    assert isinstance(first, pd.DataFrame)
+    assert len(first) == 15
+    assert len(second) == 5
+
+
+@pytest.mark.asyncio
+async def test_replay_does_not_block_event_loop(mock_kafka_consumer, tmp_path):
+    '''This test checks that other coroutines run while the data extractor waits for replayed messages'''
+    record(mock_kafka_consumer, tmp_path)
+    data_extractor = DataExtractor(ReplayConsumer(tmp_path, speed=1), None)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.ensure_future(ticker())
+    data = await data_extractor.extract_kafka_data(batch_size=20)
+    task.cancel()
+    assert len(data) == 20
+    assert ticks >= 10
+
+
+def test_recorders_do_not_overwrite(mock_kafka_consumer, tmp_path):
+    '''This test checks that a second recorder of the same process keeps the first recording'''
+    record(mock_kafka_consumer[:5], tmp_path)
+    record([MockRecord(100 + i, 2000 + i, b'{}') for i in range(3)], tmp_path)
+    replayed = list(ReplayConsumer(tmp_path, speed=0))
+    assert [msg.offset for msg in replayed] == [0, 1, 2, 3, 4, 100, 101, 102]
+
+
+def test_replay_merges_recorders_by_timestamp(tmp_path):
+    '''This test checks that the recordings of several workers are replayed in timestamp order'''
+    record([MockRecord(i, 1000 + 20 * i, b'{}') for i in range(5)], tmp_path)
+    record([MockRecord(100 + i, 1010 + 20 * i, b'{}') for i in range(5)], tmp_path)
+    replayed = list(ReplayConsumer(tmp_path, speed=0))
+    assert [msg.timestamp for msg in replayed] == sorted(msg.timestamp for msg in replayed)
+    assert [msg.offset for msg in replayed][:4] == [0, 100, 1, 101]
+
+
+def test_replaced_recorder_is_closed(mock_kafka_consumer, tmp_path):
+    '''This test checks that replacing the data extractor flushes the recorder it used'''
+    pipeline = ETPPipeline(None, None)
+    recorder = KafkaRecorder(mock_kafka_consumer, tmp_path)
+    pipeline.set_data_extractor(DataExtractor(recorder, None))
+    next(recorder)
+    pipeline.set_data_extractor(DataExtractor(ReplayConsumer(tmp_path, speed=0), None))
+    assert recorder.segment_file is None
+    assert len(list(pipeline.data_extractor.kafka_consumer)) == 1
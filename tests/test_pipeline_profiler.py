@@ -0,0 +1,115 @@
+import asyncio
+import marshal
+import tracemalloc
+import pytest
+from src.etp_orchestrator import ETPPipeline
+from src.pipeline_profiler import PipelineProfiler
+
+
+#create a mock class for the data extractor
+class MockDataExtractor:
+    async def extract_data(self, batch_size):
+        await asyncio.sleep(0)
+        return [list(range(100)) for i in range(batch_size)]
+
+
+#create a mock class for the data transformer
+class MockDataTransformer:
+    def transform_data(self, data):
+        return data, list(range(len(data))), set()
+
+
+#create a mock class for the data predictor
+class MockDataPredictor:
+    def batch_predict(self, data):
+        return [sum(row) / 1000 for row in data]
+
+
+def create_mock_pipeline(pipeline_profiler):
+    '''This function creates a pipeline with mock stages'''
+    pipeline = ETPPipeline(MockDataTransformer(), MockDataPredictor(), pipeline_profiler=pipeline_profiler)
+    pipeline.set_data_extractor(MockDataExtractor())
+    return pipeline
+
+
+@pytest.mark.asyncio
+async def test_profile_on_request():
+    '''This test checks that a requested run is profiled and tagged with the request id and batch size'''
+    profiler = PipelineProfiler()
+    pipeline = create_mock_pipeline(profiler)
+    result_dict, corrupt_data_user_ids = await pipeline.run(10, request_id=7, profile=True)
+    assert len(result_dict) == 10
+    await pipeline.run(10, request_id=8)
+    assert [profile['request_id'] for profile in profiler.list_profiles()] == [7]
+    profile = profiler.get_profile(7)
+    assert profile['batch_size'] == 10
+    assert profile['duration_seconds'] > 0
+    assert 'batch_predict' in profile['cpu_summary']
+    # the downloaded profile is in the pstats file format
+    assert isinstance(marshal.loads(profile['cpu_profile']), dict)
+    assert profiler.get_profile(8) is None
+    assert not profiler.active
+
+
+@pytest.mark.asyncio
+async def test_profile_sampling_and_ring_buffer():
+    '''This test checks that sampled runs are profiled and only the last profiles are kept'''
+    profiler = PipelineProfiler(max_profiles=3, sample_rate=1.0)
+    pipeline = create_mock_pipeline(profiler)
+    for request_id in range(5):
+        await pipeline.run(5, request_id=request_id)
+    assert [profile['request_id'] for profile in profiler.list_profiles()] == [4, 3, 2]
+
+
+@pytest.mark.asyncio
+async def test_profile_concurrent_runs():
+    '''This test checks that only one of two concurrent runs is profiled'''
+    profiler = PipelineProfiler()
+    pipeline = create_mock_pipeline(profiler)
+    await asyncio.gather(pipeline.run(5, request_id=1, profile=True), pipeline.run(5, request_id=2, profile=True))
+    assert len(profiler.list_profiles()) == 1
+    # the second run overlapped the profiled one, so the profile says it is mixed in
+    assert profiler.get_profile(1)['concurrent_runs'] == 1
+    # a run is not profiled while another one is in flight
+    assert not profiler.should_profile(True, other_runs=1)
+
+
+@pytest.mark.asyncio
+async def test_profile_failed_run():
+    '''This test checks that a failed run is still profiled and the profiler is released'''
+    profiler = PipelineProfiler()
+    pipeline = create_mock_pipeline(profiler)
+    pipeline.set_data_extractor(None)
+    assert await pipeline.run(5, request_id=3, profile=True) is None
+    assert profiler.get_profile(3) is not None
+    assert not profiler.active
+
+
+@pytest.mark.asyncio
+async def test_profile_setup_failure(monkeypatch: pytest.MonkeyPatch):
+    '''This test checks that a failing profiler setup still runs the pipeline and releases the profiler'''
+    profiler = PipelineProfiler()
+    pipeline = create_mock_pipeline(profiler)
+
+    def failing_snapshot():
+        raise RuntimeError("snapshot failed")
+    monkeypatch.setattr(tracemalloc, 'take_snapshot', failing_snapshot)
+    result_dict, corrupt_data_user_ids = await pipeline.run(5, request_id=4, profile=True)
+    assert len(result_dict) == 5
+    assert profiler.get_profile(4) is None
+    assert not profiler.active
+    assert not tracemalloc.is_tracing()
+    assert profiler.should_profile(True)
+
+
+@pytest.mark.asyncio
+async def test_profile_shared_directory(tmp_path):
+    '''This test checks that profiles stored by one worker are served by another and the ring is bounded'''
+    workers = [PipelineProfiler(max_profiles=3, directory=tmp_path) for i in range(2)]
+    for request_id in range(5):
+        await create_mock_pipeline(workers[request_id % 2]).run(5, request_id=request_id, profile=True)
+    assert [profile['request_id'] for profile in workers[0].list_profiles()] == [4, 3, 2]
+    profile = workers[0].get_profile(3)
+    assert isinstance(marshal.loads(profile['cpu_profile']), dict)
+    assert 'batch_predict' in profile['cpu_summary']
+    assert workers[1].get_profile(0) is None
@@ -0,0 +1,140 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from src.data_predictor import PurchasePredictor
+from src.prediction_cache import PredictionCache
+
+
+@pytest.fixture
+def mock_valid_df():
+    '''This function creates a mock dataframe with the model input columns and repeated rows'''
+    n_samples = 100
+    columns = PurchasePredictor().model.feature_names_in_
+    df = pd.DataFrame(np.random.randint(0, 10, (n_samples, len(columns))), columns=columns)
+    return pd.concat([df, df.iloc[:50]], ignore_index=True)
+
+
+def test_cached_predictions(mock_valid_df):
+    '''This test checks that cached predictions equal the model predictions and hit the cache'''
+    cache = PredictionCache(max_size=1000)
+    cached_predictor = PurchasePredictor(prediction_cache=cache)
+    expected = PurchasePredictor().batch_predict(mock_valid_df)
+    assert np.allclose(cached_predictor.batch_predict(mock_valid_df), expected)
+    assert cache.stats()['misses'] == 150
+    assert np.allclose(cached_predictor.batch_predict(mock_valid_df), expected)
+    assert cache.stats()['hits'] == 150
+    assert cache.stats()['size'] == 100
+
+
+def test_cache_lru_eviction():
+    '''This test checks that the least recently used entries are evicted first'''
+    cache = PredictionCache(max_size=3)
+    cache.lookup(np.array([1, 2, 3], dtype=np.uint64), 'v1')
+    cache.insert(np.array([1, 2, 3], dtype=np.uint64), [0.1, 0.2, 0.3])
+    cache.lookup(np.array([1, 3], dtype=np.uint64), 'v1')
+    cache.insert(np.array([4], dtype=np.uint64), [0.4])
+    predictions, missing = cache.lookup(np.array([1, 2, 3, 4], dtype=np.uint64), 'v1')
+    assert missing.tolist() == [False, True, False, False]
+    assert np.allclose(predictions[~missing], [0.1, 0.3, 0.4])
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_ttl():
+    '''This test checks that expired entries are misses and are replaced in place'''
+    cache = PredictionCache(max_size=10, ttl_seconds=0.05)
+    hashes = np.array([1, 2], dtype=np.uint64)
+    cache.lookup(hashes, 'v1')
+    cache.insert(hashes, [0.1, 0.2])
+    time.sleep(0.1)
+    predictions, missing = cache.lookup(hashes, 'v1')
+    assert missing.all()
+    cache.insert(hashes, [0.3, 0.4])
+    predictions, missing = cache.lookup(hashes, 'v1')
+    assert not missing.any()
+    assert np.allclose(predictions, [0.3, 0.4])
+    assert cache.stats()['size'] == 2
+
+
+def test_cache_model_version_invalidation(mock_valid_df):
+    '''This test checks that the cache is invalidated on a new model version and on model reload'''
+    cache = PredictionCache(max_size=1000)
+    cached_predictor = PurchasePredictor(prediction_cache=cache)
+    cached_predictor.batch_predict(mock_valid_df)
+    cached_predictor.reload_model()
+    assert cache.stats()['size'] == 0
+    cached_predictor.batch_predict(mock_valid_df)
+    predictions, missing = cache.lookup(cache.hash_rows(mock_valid_df), 'another model')
+    assert missing.all()
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_invalid_cache_size():
+    '''This test checks that a cache without capacity is rejected'''
+    with pytest.raises(ValueError):
+        PredictionCache(max_size=0)
+
+
+def test_cache_reclaims_expired_first():
+    '''This test checks that a full cache reclaims an expired entry before the least recently used live one'''
+    cache = PredictionCache(max_size=3, ttl_seconds=60)
+    cache.lookup(np.array([2, 3], dtype=np.uint64), 'v1')
+    cache.insert(np.array([2, 3], dtype=np.uint64), [0.2, 0.3])
+    # entry 1 is used more recently than entry 3 but expires
+    cache.ttl_seconds = 0.05
+    cache.lookup(np.array([1], dtype=np.uint64), 'v1')
+    cache.insert(np.array([1], dtype=np.uint64), [0.1])
+    time.sleep(0.1)
+    cache.ttl_seconds = 60
+    cache.lookup(np.array([4], dtype=np.uint64), 'v1')
+    cache.insert(np.array([4], dtype=np.uint64), [0.4])
+    predictions, missing = cache.lookup(np.array([2, 3, 4], dtype=np.uint64), 'v1')
+    assert not missing.any()
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['evictions'] == 0
+
+
+class CountingDict(dict):
+    '''A dict counting the keys looked up with get'''
+    lookups = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return super().get(key, default)
+
+
+def fill_cache(cache):
+    '''This function fills every slot of the cache with distinct keys'''
+    cache.lookup(np.zeros(0, dtype=np.uint64), 'v1')
+    cache.insert(np.arange(1, cache.max_size + 1, dtype=np.uint64), np.zeros(cache.max_size))
+
+
+def test_full_cache_reclaims_in_chunks(monkeypatch: pytest.MonkeyPatch):
+    '''This test checks that a full cache does not scan its slots on every batch of misses'''
+    cache = PredictionCache(max_size=1000, ttl_seconds=60)
+    fill_cache(cache)
+    reclaims = []
+    reclaim = cache._reclaim
+
+    def counting_reclaim(needed, protected):
+        reclaims.append(needed)
+        reclaim(needed, protected)
+    monkeypatch.setattr(cache, '_reclaim', counting_reclaim)
+    for batch in range(20):
+        hashes = np.arange(5, dtype=np.uint64) + np.uint64(10000 + batch * 5)
+        cache.lookup(hashes, 'v1')
+        cache.insert(hashes, np.ones(5))
+    # every reclaim frees a chunk of 1% of the slots, enough for two batches of 5 misses
+    assert len(reclaims) == 10
+    assert cache.stats()['size'] == 1000
+    assert cache.stats()['evictions'] == 100
+
+
+def test_find_touches_only_the_batch():
+    '''This test checks that a lookup in a full cache only looks up the keys of the batch'''
+    cache = PredictionCache(max_size=1000, ttl_seconds=60)
+    fill_cache(cache)
+    cache.slots = CountingDict(cache.slots)
+    predictions, missing = cache.lookup(np.array([1, 2, 5000], dtype=np.uint64), 'v1')
+    assert cache.slots.lookups == 3
+    assert missing.tolist() == [False, False, True]
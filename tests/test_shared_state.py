@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from src.data_predictor import PurchasePredictor
+from src.shared_state import SharedState
+
+
+@pytest.fixture
+def mock_shared_state():
+    '''This function creates a shared state owned by the test and removes it afterwards'''
+    shared_state = SharedState("moon_test_{}".format(os.getpid()), create=True, model=PurchasePredictor().model)
+    yield shared_state
+    shared_state.close()
+
+
+@pytest.fixture
+def mock_valid_df():
+    '''This function creates a mock dataframe with the model input columns'''
+    n_samples = 100
+    columns = PurchasePredictor().model.feature_names_in_
+    return pd.DataFrame(np.random.uniform(0, 10, (n_samples, len(columns))), columns=columns)
+
+
+def test_shared_model_predictions(mock_shared_state, mock_valid_df):
+    '''This test checks that a worker attached to the shared state predicts like the original model'''
+    worker_state = SharedState(mock_shared_state.name)
+    try:
+        shared_predictor = PurchasePredictor(shared_state=worker_state)
+        predictions = shared_predictor.batch_predict(mock_valid_df)
+        expected = PurchasePredictor().batch_predict(mock_valid_df)
+        assert np.allclose(predictions, expected)
+        del shared_predictor
+    finally:
+        worker_state.close()
+
+
+def test_shared_request_id_counter(mock_shared_state):
+    '''This test checks that request ids are unique across attached workers'''
+    worker_state = SharedState(mock_shared_state.name)
+    try:
+        ids = [mock_shared_state.next_request_id(), worker_state.next_request_id(), mock_shared_state.next_request_id()]
+        assert ids == [0, 1, 2]
+    finally:
+        worker_state.close()
+
+
+def test_config_broadcast(mock_shared_state):
+    '''This test checks that a published configuration is visible to the other workers with a new version'''
+    worker_state = SharedState(mock_shared_state.name)
+    try:
+        assert worker_state.read_config() == (0, None)
+        assert worker_state.config_version() == 0
+        config = {'kafka_config': {'topics': 'events'}, 'mysql_config': {'host': 'localhost'}}
+        assert mock_shared_state.publish_config(config) == 1
+        assert worker_state.config_version() == 1
+        assert worker_state.read_config() == (1, config)
+        assert worker_state.publish_config(config) == 2
+    finally:
+        worker_state.close()
+
+
+def test_config_broadcast_too_large(mock_shared_state):
+    '''This test checks that an oversized configuration is rejected'''
+    with pytest.raises(ValueError):
+        mock_shared_state.publish_config({'kafka_config': 'x' * 100000})
+
+
+def test_config_version_without_lock(mock_shared_state, monkeypatch):
+    '''This test checks that the version check on every request does not take the cross process lock'''
+    worker_state = SharedState(mock_shared_state.name)
+    try:
+        mock_shared_state.publish_config({'kafka_config': {}, 'mysql_config': {}})
+
+        def locked():
+            raise AssertionError("the lock was taken")
+        monkeypatch.setattr(worker_state, '_locked', locked)
+        assert worker_state.config_version() == 1
+    finally:
+        worker_state.close()